@@ -1,6 +1,9 @@
-from collections import OrderedDict
+import functools
 import logging
-from django.db import transaction, router
+import operator
+from django.db import connections, transaction, router
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +13,74 @@ def _get_key(obj, key_fields):
     return tuple(getattr(obj, k) for k in key_fields)
 
 
+@functools.lru_cache(maxsize=None)
+def _default_sync_fields(model):
+    """Names of the fields `bulk_sync` updates when `fields` isn't given."""
+    # Fields that aren't PKs and aren't editable (e.g. auto_add_now) are left out for bulk_update
+    return tuple(
+        field.name
+        for field in model._meta.fields
+        if not field.primary_key and not field.auto_created and field.editable
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _compare_fields(model, ignore_fields=frozenset()):
+    """Concrete fields of `model` compared by `compare_objs`, and a getter returning a tuple of their values."""
+    # Ignored fields are left out of the getter too, so a deferred ignored field is never loaded.
+    fields = tuple(f for f in model._meta.concrete_fields if f.attname not in ignore_fields)
+    if len(fields) == 1:
+        # attrgetter with a single name returns the bare value rather than a 1-tuple.
+        get_value = operator.attrgetter(fields[0].attname)
+
+        def get_values(obj):
+            return (get_value(obj),)
+
+    elif fields:
+        get_values = operator.attrgetter(*(f.attname for f in fields))
+    else:
+
+        def get_values(obj):
+            return ()
+
+    return fields, get_values
+
+
+def _apply_filters(objs, filters):
+    """Narrow queryset `objs` by `filters`, which may be a Q() or a dict of field lookups."""
+    if not filters:
+        return objs
+    if isinstance(filters, dict):
+        return objs.filter(**filters)
+    return objs.filter(filters)
+
+
+def _bulk_update_columns(model, using, pks, columns, batch_size=None):
+    """Update rows `pks` of `model` from `columns`, one `UPDATE ... CASE WHEN` query per batch."""
+    if not pks:
+        return
+
+    model_fields = [model._meta.get_field(name) for name in columns]
+    connection = connections[using]
+    max_batch_size = connection.ops.bulk_batch_size(["pk", "pk"] + model_fields, pks)
+    batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+
+    for start in range(0, len(pks), batch_size):
+        batch_pks = pks[start : start + batch_size]
+        update_kwargs = {}
+        for field, values in zip(model_fields, columns.values()):
+            whens = [
+                When(pk=pk, then=Value(value, output_field=field))
+                for pk, value in zip(batch_pks, values[start : start + batch_size])
+            ]
+            case_statement = Case(*whens, output_field=field)
+            if connection.features.requires_casted_case_in_updates:
+                # e.g. PostgreSQL, where a CASE over untyped parameters would otherwise resolve to text.
+                case_statement = Cast(case_statement, output_field=field)
+            update_kwargs[field.attname] = case_statement
+        model.objects.filter(pk__in=batch_pks).update(**update_kwargs)
+
+
 def bulk_sync(
     new_models,
     key_fields,
@@ -25,29 +96,29 @@ def bulk_sync(
     `new_models`: Django ORM objects that are the desired state.  They may or may not have `id` set.
     `key_fields`: Identifying attribute name(s) to match up `new_models` items with database rows.  If a foreign key
             is being used as a key field, be sure to pass the `fieldname_id` rather than the `fieldname`.
-    `filters`: Q() filters specifying the subset of the database to work in.  Use `None` or `[]` if you want to sync against the entire table.
+    `filters`: Q() filters, or a dict of field lookups such as `{"company_id": 501}`, specifying the subset of the
+            database to work in.  Use `None` or `[]` if you want to sync against the entire table.
     `batch_size`: (optional) passes through to Django `bulk_create.batch_size` and `bulk_update.batch_size`, and controls
             how many objects are created/updated per SQL query.
     `fields`: (optional) list of fields to update. If not set, will sync all fields that are editable and not auto-created.
     `skip_creates`: If truthy, will not perform any object creations needed to fully sync. Defaults to not skip.
     `skip_updates`: If truthy, will not perform any object updates needed to fully sync. Defaults to not skip.
     `skip_deletes`: If truthy, will not perform any object deletions needed to fully sync. Defaults to not skip.
+
+    Returns: dict of
+        'stats': dict of the number of objects 'created', 'updated' and 'deleted'.
+        'created_instances': list of the `new_models` objects that were created.
+        'updated_instances': dict of {pk: obj} for the `new_models` objects that were updated.
+        'deleted_ids': list of the PKs of the deleted rows.
     """
     db_class = new_models[0].__class__
 
     if fields is None:
-        # Get a list of fields that aren't PKs and aren't editable (e.g. auto_add_now) for bulk_update
-        fields = [
-            field.name
-            for field in db_class._meta.fields
-            if not field.primary_key and not field.auto_created and field.editable
-        ]
+        fields = _default_sync_fields(db_class)
 
     using = router.db_for_write(db_class)
     with transaction.atomic(using=using):
-        objs = db_class.objects.select_for_update().all()
-        if filters:
-            objs = objs.filter(filters)
+        objs = _apply_filters(db_class.objects.select_for_update().all(), filters)
 
         obj_dict = {_get_key(obj, key_fields): obj for obj in objs}
 
@@ -68,9 +139,10 @@ def bulk_sync(
         if not skip_updates:
             db_class.objects.bulk_update(existing_objs, fields=fields, batch_size=batch_size)
 
+        stale_pks = [_.pk for _ in obj_dict.values()]
         if not skip_deletes:
             # delete stale objects
-            objs.filter(pk__in=[_.pk for _ in list(obj_dict.values())]).delete()
+            objs.filter(pk__in=stale_pks).delete()
 
         assert len(existing_objs) == len(new_models) - len(new_objs)
 
@@ -86,7 +158,115 @@ def bulk_sync(
             )
         )
 
-    return {"stats": stats}
+    return {
+        "stats": stats,
+        "created_instances": [] if skip_creates else new_objs,
+        "updated_instances": {} if skip_updates else {obj.pk: obj for obj in existing_objs},
+        "deleted_ids": [] if skip_deletes else stale_pks,
+    }
+
+
+def bulk_sync_columnar(
+    model,
+    columns,
+    key_fields,
+    filters,
+    batch_size=None,
+    fields=None,
+    skip_creates=False,
+    skip_updates=False,
+    skip_deletes=False,
+):
+    """ Like `bulk_sync`, but the desired state is given as columns of values rather than as model instances.
+
+    `model`: Django model class to sync.
+    `columns`: dict of {attribute name: sequence of values}.  All sequences must have the same length; the i-th value
+            of every column together make up the i-th row.  If a foreign key is being used, be sure to pass the
+            `fieldname_id` rather than the `fieldname`.
+    `key_fields`: Identifying attribute name(s) to match up rows with database rows.  Each must be a key of `columns`.
+    `filters`: Q() filters, or a dict of field lookups such as `{"company_id": 501}`, specifying the subset of the
+            database to work in.  Use `None` or `[]` if you want to sync against the entire table.
+    `batch_size`: (optional) passes through to Django `bulk_create.batch_size`, and controls how many objects are
+            created/updated per SQL query.
+    `fields`: (optional) list of columns to update. If not set, will update all columns except the PK.  Must not be
+            empty unless `skip_updates` is set.
+    `skip_creates`: If truthy, will not perform any object creations needed to fully sync. Defaults to not skip.
+    `skip_updates`: If truthy, will not perform any object updates needed to fully sync. Defaults to not skip.
+    `skip_deletes`: If truthy, will not perform any object deletions needed to fully sync. Defaults to not skip.
+
+    Model instances are only built for rows that need to be created.  Existing rows are matched without loading them
+    as model instances, and updates are issued straight from the column values.
+
+    Returns: dict of
+        'stats': dict of the number of rows 'created', 'updated' and 'deleted'.
+        'created_instances': list of the model instances built for and created from new rows.
+        'deleted_ids': list of the PKs of the deleted rows.
+    Unlike `bulk_sync`, there is no 'updated_instances', since no instances are built for updated rows.
+    """
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All columns passed to bulk_sync_columnar must have the same length.")
+
+    if fields is None:
+        fields = [name for name in columns if name != "pk" and not model._meta.get_field(name).primary_key]
+    if not fields and not skip_updates:
+        # Same as bulk_sync, where Django's bulk_update refuses an empty field list.
+        raise ValueError("Field names must be given to bulk_sync_columnar() unless skip_updates is set.")
+
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        objs = _apply_filters(model.objects.select_for_update().all(), filters)
+
+        pk_dict = {tuple(row[1:]): row[0] for row in objs.values_list("pk", *key_fields)}
+
+        new_rows = []
+        existing_rows = []
+        existing_pks = []
+        for i, key in enumerate(zip(*(columns[k] for k in key_fields))):
+            pk = pk_dict.pop(key, None)
+            if pk is None:
+                # This is a new row, so create it.
+                new_rows.append(i)
+            else:
+                existing_rows.append(i)
+                existing_pks.append(pk)
+
+        new_objs = []
+        if not skip_creates:
+            new_objs = [model(**{name: values[i] for name, values in columns.items()}) for i in new_rows]
+            model.objects.bulk_create(new_objs, batch_size=batch_size)
+
+        if not skip_updates:
+            _bulk_update_columns(
+                model,
+                using,
+                existing_pks,
+                {name: [columns[name][i] for i in existing_rows] for name in fields},
+                batch_size=batch_size,
+            )
+
+        stale_pks = list(pk_dict.values())
+        if not skip_deletes:
+            # delete stale objects
+            objs.filter(pk__in=stale_pks).delete()
+
+        stats = {
+            "created": 0 if skip_creates else len(new_rows),
+            "updated": 0 if skip_updates else len(existing_rows),
+            "deleted": 0 if skip_deletes else len(pk_dict),
+        }
+
+        logger.debug(
+            "{}: {} created, {} updated, {} deleted.".format(
+                model.__name__, stats["created"], stats["updated"], stats["deleted"]
+            )
+        )
+
+    return {
+        "stats": stats,
+        "created_instances": new_objs,
+        "deleted_ids": [] if skip_deletes else stale_pks,
+    }
 
 
 def bulk_compare(old_models, new_models, key_fields, ignore_fields=None):
@@ -106,7 +286,7 @@ def bulk_compare(old_models, new_models, key_fields, ignore_fields=None):
 
     """
 
-    old_obj_dict = OrderedDict((_get_key(obj, key_fields), obj) for obj in old_models)
+    old_obj_dict = {_get_key(obj, key_fields): obj for obj in old_models}
 
     new_objs = []
     change_details = {}
@@ -151,13 +331,10 @@ def compare_objs(obj1, obj2, ignore_fields=None):
     """
 
     ret = {}
-    fields = obj1._meta.get_fields()
-    for f in fields:
-        if ignore_fields and f.attname in ignore_fields:
-            continue
-
-        v1 = f.to_python(getattr(obj1, f.attname))
-        v2 = f.to_python(getattr(obj2, f.attname))
+    fields, get_values = _compare_fields(obj1.__class__, frozenset(ignore_fields or ()))
+    for f, v1, v2 in zip(fields, get_values(obj1), get_values(obj2)):
+        v1 = f.to_python(v1)
+        v2 = f.to_python(v2)
         if v1 != v2:
             ret[f.name] = (v1, v2)
 
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import argparse
 import os
 import sys
 import django
@@ -12,7 +13,21 @@ if __name__ == "__main__":
     django.setup()
 
     TestRunner = get_runner(settings)
-    test_runner = TestRunner()
-    failures = test_runner.run_tests(["tests"])
+
+    # Accept the test runner's options and `-v`, like `manage.py test`, e.g. `--keepdb` or `--parallel 4`.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("test_labels", nargs="*", default=["tests"])
+    parser.add_argument("-v", "--verbosity", type=int, choices=[0, 1, 2, 3], default=1)
+    TestRunner.add_arguments(parser)
+    options = vars(parser.parse_args())
+    test_labels = options.pop("test_labels")
+
+    if options.get("parallel") == "auto":
+        # `manage.py test` resolves a bare `--parallel` to a process count before building the runner.
+        from django.test.runner import get_max_test_processes
+
+        options["parallel"] = get_max_test_processes()
+
+    test_runner = TestRunner(**options)
+    failures = test_runner.run_tests(test_labels)
     sys.exit(bool(failures))
-    
\ No newline at end of file
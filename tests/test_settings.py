@@ -7,7 +7,7 @@ SECRET_KEY = 'testsecretkey43u2894u329h432nuhrn32iu'
 DEBUG = True
 
 db_url = os.environ.get("DATABASE_URL", "sqlite://localhost/:memory:")
-DB = dj_database_url.parse(db_url)
+DB = dj_database_url.parse(db_url, conn_max_age=None)
 
 DATABASES = {
     'default': DB,
@@ -1,27 +1,56 @@
+from array import array
+from collections import Counter
+
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, connection, transaction
 from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from bulk_sync import bulk_compare
 from bulk_sync import bulk_sync
+from bulk_sync import bulk_sync_columnar
+from bulk_sync import compare_objs
 from .models import Company, Employee
 
+KEY_FIELDS = ("name",)
 
-class BulkSyncTests(TestCase):
-    """ Test `bulk_sync` method """
 
-    def setUp(self):
-        pass
+def _bulk_create(model, objs):
+    """ `bulk_create` `objs` in one INSERT and return them with PKs set, even on backends that can't return them. """
+    created = model.objects.bulk_create(objs)
+    if created and created[0].pk is None:
+        # e.g. MySQL: rows are inserted in order with ascending PKs, so read them back.
+        created = list(model.objects.order_by("-pk")[: len(objs)])[::-1]
+    return created
+
+
+class TwoCompaniesTestCase(TestCase):
+    """ Shared baseline: Scott, Isaac and Zoe work at c1, Bob works at c2. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.c1, cls.c2 = _bulk_create(
+            Company, [Company(name="Foo Products, Ltd."), Company(name="Bar Microcontrollers, Inc.")]
+        )
+
+        cls.e1, cls.e2, cls.e3, cls.e4 = _bulk_create(
+            Employee,
+            [
+                Employee(name="Scott", age=40, company=cls.c1),
+                Employee(name="Isaac", age=9, company=cls.c1),
+                Employee(name="Zoe", age=9, company=cls.c1),
+                Employee(name="Bob", age=25, company=cls.c2),
+            ],
+        )
 
-    def test_all_features_at_once(self):
-        c1 = Company.objects.create(name="Foo Products, Ltd.")
-        c2 = Company.objects.create(name="Bar Microcontrollers, Inc.")
 
-        e1 = Employee.objects.create(name="Scott", age=40, company=c1)
-        e2 = Employee.objects.create(name="Isaac", age=9, company=c1)
-        e3 = Employee.objects.create(name="Zoe", age=9, company=c1)
-        e4 = Employee.objects.create(name="Bob", age=25, company=c2)
+class BulkSyncTests(TwoCompaniesTestCase):
+    """ Test `bulk_sync` method """
+
+    def test_all_features_at_once(self):
+        c1, c2 = self.c1, self.c2
+        e1, e2, e3, e4 = self.e1, self.e2, self.e3, self.e4
 
         # We should update Scott's and Isaac's age, delete Zoe, add Newguy and
         # add a second Bob (since he's not in company c1, which we filtered on.)
@@ -32,98 +61,267 @@ class BulkSyncTests(TestCase):
             Employee(name="Bob", age=50, company=c1),
         ]
 
-        ret = bulk_sync(new_models=new_objs, filters=Q(company_id=c1.id), key_fields=("name",))
+        ret = bulk_sync(new_models=new_objs, filters=Q(company_id=c1.id), key_fields=KEY_FIELDS)
 
         self.assertEqual(2, ret["stats"]["updated"])
         self.assertEqual(2, ret["stats"]["created"])
         self.assertEqual(1, ret["stats"]["deleted"])
 
-        self.assertEqual(4, Employee.objects.filter(company=c1).count())
-        self.assertEqual(1, Employee.objects.filter(company=c2).count())
+        self.assertEqual({e1.id: new_objs[0], e2.id: new_objs[1]}, ret["updated_instances"])
+        self.assertEqual([new_objs[2], new_objs[3]], ret["created_instances"])
+        self.assertEqual([e3.id], ret["deleted_ids"])
 
-        new_e1 = Employee.objects.get(id=e1.id)
+        # Cross-check the database state.
+        emps = Employee.objects.filter(company_id__in=[c1.id, c2.id]).select_related("company").in_bulk()
+        emps_by_key = {(e.name, e.company_id): e for e in emps.values()}
+
+        counts = Counter(e.company_id for e in emps.values())
+        self.assertEqual(4, counts[c1.id])
+        self.assertEqual(1, counts[c2.id])
+
+        new_e1 = emps[e1.id]
         self.assertEqual("Scott", new_e1.name)
         self.assertEqual(41, new_e1.age)
         self.assertEqual(c1, new_e1.company)
 
-        new_e2 = Employee.objects.get(id=e2.id)
+        new_e2 = emps[e2.id]
         self.assertEqual("Isaac", new_e2.name)
         self.assertEqual(9, new_e2.age)
         self.assertEqual(c1, new_e2.company)
 
-        with self.assertRaises(Employee.DoesNotExist):
-            Employee.objects.get(id=e3.id)
+        self.assertNotIn(e3.id, emps)
 
-        new_e4 = Employee.objects.get(id=e4.id)
+        new_e4 = emps[e4.id]
         self.assertEqual("Bob", new_e4.name)
         self.assertEqual(25, new_e4.age)
         self.assertEqual(c2, new_e4.company)
 
-        new_e3 = Employee.objects.get(name="Newguy")
+        new_e3 = emps_by_key[("Newguy", c1.id)]
         self.assertEqual("Newguy", new_e3.name)
         self.assertEqual(10, new_e3.age)
         self.assertEqual(c1, new_e3.company)
 
-        new_e5 = Employee.objects.get(name="Bob", company=c1)
+        new_e5 = emps_by_key[("Bob", c1.id)]
         self.assertEqual("Bob", new_e5.name)
         self.assertEqual(50, new_e5.age)
         self.assertEqual(c1, new_e5.company)
 
     def test_provided_pk_is_retained_but_raises_if_mismatch_with_keyfield(self):
-        c1 = Company.objects.create(name="Foo Products, Ltd.")
-        e1 = Employee.objects.create(name="Scott", age=40, company=c1)
+        c1 = self.c1
+        e1 = self.e1
         new_objs = [Employee(id=e1.id, name="Notscott", age=41, company=c1)]
 
-        with self.assertRaises(IntegrityError):
+        with self.assertRaises(IntegrityError), transaction.atomic():
             # Crashes because e1.id already exists in database, even though 'name' doesnt match so it tries to INSERT.
-            ret = bulk_sync(new_models=new_objs, filters=Q(company_id=c1.id), key_fields=("name",))
+            ret = bulk_sync(new_models=new_objs, filters={"company_id": c1.id}, key_fields=KEY_FIELDS)
 
-        unique_pk = Employee.objects.values_list('id', flat=True).order_by('-id').first() + 1
+        unique_pk = max(e.pk for e in (self.e1, self.e2, self.e3, self.e4)) + 1
         new_objs = [Employee(id=unique_pk, name="Notscott", age=41, company=c1)]
-        ret = bulk_sync(new_models=new_objs, filters=Q(company_id=c1.id), key_fields=("name",))
+        ret = bulk_sync(new_models=new_objs, filters={"company_id": c1.id}, key_fields=KEY_FIELDS)
 
         self.assertEqual(0, ret["stats"]["updated"])
         self.assertEqual(1, ret["stats"]["created"]) # Added 'Notscott'
-        self.assertEqual(1, ret["stats"]["deleted"]) # Deleted 'Scott'
+        self.assertEqual(3, ret["stats"]["deleted"]) # Deleted 'Scott', 'Isaac' and 'Zoe'
 
         # Make sure we retained the PK
         self.assertEqual(Employee.objects.filter(id=unique_pk).count(), 1)
 
 
     def test_fields_parameter(self):
-        c1 = Company.objects.create(name="Foo Products, Ltd.")
-        c2 = Company.objects.create(name="Bar Microcontrollers, Inc.")
-
-        e1 = Employee.objects.create(name="Scott", age=40, company=c1)
-        e2 = Employee.objects.create(name="Isaac", age=9, company=c2)
+        c1, c2 = self.c1, self.c2
+        e1, e4 = self.e1, self.e4
 
-        # We should update Scott's age, and not touch company.
+        # We should update Scott's and Bob's age, and not touch Bob's company.
         new_objs = [
             Employee(name="Scott", age=41, company=c1),
             Employee(name="Isaac", age=9, company=c1),
+            Employee(name="Zoe", age=9, company=c1),
+            Employee(name="Bob", age=26, company=c1),
         ]
 
-        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=("name",), fields=['age'])
+        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=KEY_FIELDS, fields=['age'])
 
-        new_e1 = Employee.objects.get(id=e1.id)
+        emps = Employee.objects.select_related("company").in_bulk([e1.id, e4.id])
+
+        new_e1 = emps[e1.id]
         self.assertEqual("Scott", new_e1.name)
         self.assertEqual(41, new_e1.age)
         self.assertEqual(c1, new_e1.company)
 
-        new_e2 = Employee.objects.get(id=e2.id)
-        self.assertEqual("Isaac", new_e2.name)
-        self.assertEqual(9, new_e2.age)
-        self.assertEqual(c2, new_e2.company)
+        new_e4 = emps[e4.id]
+        self.assertEqual("Bob", new_e4.name)
+        self.assertEqual(26, new_e4.age)
+        self.assertEqual(c2, new_e4.company)
+
+        self.assertEqual(4, ret["stats"]["updated"])
+        self.assertEqual(0, ret["stats"]["created"])
+        self.assertEqual(0, ret["stats"]["deleted"])
+
+
+class BulkSyncColumnarTests(TwoCompaniesTestCase):
+    """ Test `bulk_sync_columnar` method """
+
+    def test_all_features_at_once(self):
+        c1, c2 = self.c1, self.c2
+        e1, e2, e3, e4 = self.e1, self.e2, self.e3, self.e4
+
+        # Same scenario as BulkSyncTests.test_all_features_at_once, expressed as columns.
+        columns = {
+            "name": ["Scott", "Isaac", "Newguy", "Bob"],
+            "age": array("i", [41, 9, 10, 50]),
+            "company_id": [c1.id] * 4,
+        }
+
+        ret = bulk_sync_columnar(model=Employee, columns=columns, filters={"company_id": c1.id}, key_fields=KEY_FIELDS)
+
+        self.assertEqual(2, ret["stats"]["updated"])
+        self.assertEqual(2, ret["stats"]["created"])
+        self.assertEqual(1, ret["stats"]["deleted"])
+
+        self.assertEqual(["Newguy", "Bob"], [e.name for e in ret["created_instances"]])
+        self.assertEqual([e3.id], ret["deleted_ids"])
+
+        emps = Employee.objects.in_bulk()
+        emps_by_key = {(e.name, e.company_id): e for e in emps.values()}
+
+        self.assertEqual(41, emps[e1.id].age)
+        self.assertEqual(9, emps[e2.id].age)
+        self.assertNotIn(e3.id, emps)
+        self.assertEqual(25, emps[e4.id].age)
+        self.assertEqual(c2.id, emps[e4.id].company_id)
+        self.assertEqual(10, emps_by_key[("Newguy", c1.id)].age)
+        self.assertEqual(50, emps_by_key[("Bob", c1.id)].age)
+
+    def test_fields_parameter(self):
+        c1, c2 = self.c1, self.c2
+
+        # Only age is updated; Bob stays in his company.
+        columns = {
+            "name": ["Scott", "Bob"],
+            "age": [41, 26],
+            "company_id": [c1.id, c1.id],
+        }
+
+        ret = bulk_sync_columnar(
+            model=Employee, columns=columns, filters=None, key_fields=KEY_FIELDS, fields=["age"], skip_deletes=True
+        )
 
         self.assertEqual(2, ret["stats"]["updated"])
         self.assertEqual(0, ret["stats"]["created"])
         self.assertEqual(0, ret["stats"]["deleted"])
 
-    def test_skip_deletes(self):
-        c1 = Company.objects.create(name="My Company LLC")
+        emps = Employee.objects.in_bulk([self.e1.id, self.e4.id])
+        self.assertEqual(41, emps[self.e1.id].age)
+        self.assertEqual(26, emps[self.e4.id].age)
+        self.assertEqual(c2.id, emps[self.e4.id].company_id)
+
+    def test_updates_in_several_batches(self):
+        c1 = self.c1
+        e1, e2, e3 = self.e1, self.e2, self.e3
+
+        columns = {
+            "name": ["Scott", "Isaac", "Zoe"],
+            "age": [41, 10, 11],
+            "company_id": [c1.id] * 3,
+        }
+
+        with CaptureQueriesContext(connection) as ctx:
+            ret = bulk_sync_columnar(
+                model=Employee, columns=columns, filters={"company_id": c1.id}, key_fields=KEY_FIELDS, batch_size=2
+            )
+
+        self.assertEqual(3, ret["stats"]["updated"])
+        updates = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(2, len(updates))
+
+        self.assertEqual(
+            {e1.id: 41, e2.id: 10, e3.id: 11},
+            dict(Employee.objects.filter(company=c1).values_list("id", "age")),
+        )
+
+    def test_skip_creates_and_updates(self):
+        c1 = self.c1
+
+        columns = {
+            "name": ["Scott", "Newguy"],
+            "age": [41, 10],
+            "company_id": [c1.id, c1.id],
+        }
+
+        ret = bulk_sync_columnar(
+            model=Employee,
+            columns=columns,
+            filters={"company_id": c1.id},
+            key_fields=KEY_FIELDS,
+            skip_creates=True,
+            skip_updates=True,
+        )
+
+        self.assertEqual(0, ret["stats"]["updated"])
+        self.assertEqual(0, ret["stats"]["created"])
+        self.assertEqual(2, ret["stats"]["deleted"])
+
+        self.assertEqual([], ret["created_instances"])
+        self.assertEqual({self.e2.id, self.e3.id}, set(ret["deleted_ids"]))
+
+        # Only Scott is left, with his age untouched and Newguy not added.
+        self.assertEqual([("Scott", 40)], list(Employee.objects.filter(company=c1).values_list("name", "age")))
+
+    def test_empty_fields_raise_unless_skipping_updates(self):
+        columns = {"name": ["Scott"], "age": [41], "company_id": [self.c1.id]}
+
+        with self.assertRaises(ValueError):
+            bulk_sync_columnar(model=Employee, columns=columns, filters=None, key_fields=KEY_FIELDS, fields=[])
+
+        ret = bulk_sync_columnar(
+            model=Employee, columns=columns, filters=None, key_fields=KEY_FIELDS, fields=[], skip_updates=True
+        )
+        self.assertEqual(0, ret["stats"]["updated"])
+        self.assertEqual(40, Employee.objects.get(id=self.e1.id).age)
+
+    def test_pk_as_key_field(self):
+        c1 = self.c1
+        unique_pk = max(e.pk for e in (self.e1, self.e2, self.e3, self.e4)) + 1
 
-        e1 = Employee.objects.create(name="Scott", age=40, company=c1)
-        e2 = Employee.objects.create(name="Isaac", age=9, company=c1)
+        columns = {
+            "pk": [self.e1.pk, unique_pk],
+            "name": ["Scott", "Newguy"],
+            "age": [41, 10],
+            "company_id": [c1.id, c1.id],
+        }
+
+        ret = bulk_sync_columnar(model=Employee, columns=columns, filters={"company_id": c1.id}, key_fields=("pk",))
+
+        self.assertEqual(1, ret["stats"]["updated"])
+        self.assertEqual(1, ret["stats"]["created"])
+        self.assertEqual(2, ret["stats"]["deleted"])
+
+        self.assertEqual(
+            [(self.e1.pk, "Scott", 41), (unique_pk, "Newguy", 10)],
+            list(Employee.objects.filter(company=c1).order_by("pk").values_list("pk", "name", "age")),
+        )
+
+    def test_mismatched_column_lengths_raise(self):
+        with self.assertRaises(ValueError):
+            bulk_sync_columnar(
+                model=Employee, columns={"name": ["Scott"], "age": [1, 2]}, filters=None, key_fields=KEY_FIELDS
+            )
+
+
+class BulkSyncSkipTests(TestCase):
+    """ Test `bulk_sync` method's `skip_*` flags """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.c1 = Company.objects.create(name="My Company LLC")
+
+        cls.e1, cls.e2 = _bulk_create(
+            Employee, [Employee(name="Scott", age=40, company=cls.c1), Employee(name="Isaac", age=9, company=cls.c1)]
+        )
+
+    def test_skip_deletes(self):
+        c1 = self.c1
+        e1 = self.e1
 
         # update Scott - this makes Isaac is the "stale object" that would be deleted if skip_deletes were False
         new_objs = [
@@ -131,44 +329,40 @@ class BulkSyncTests(TestCase):
         ]
 
         # but Isaac should remain when the skip_deletes flag is True
-        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=("name",), skip_deletes=True)
-
-        self.assertEqual(["Scott", "Isaac"], [x.name for x in Employee.objects.all().order_by('id')])
-
-        new_e1 = Employee.objects.get(id=e1.id)
-        self.assertEqual(41, new_e1.age)
+        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=KEY_FIELDS, skip_deletes=True)
 
-        self.assertEqual(2, Employee.objects.count())
+        self.assertEqual(
+            [("Scott", 41), ("Isaac", 9)], list(Employee.objects.order_by('id').values_list('name', 'age'))
+        )
 
         self.assertEqual(1, ret["stats"]["updated"])
         self.assertEqual(0, ret["stats"]["created"])
         self.assertEqual(0, ret["stats"]["deleted"])
 
-    def test_skip_creates(self):
-        c1 = Company.objects.create(name="My Company LLC")
+        self.assertEqual({e1.id: new_objs[0]}, ret["updated_instances"])
+        self.assertEqual([], ret["deleted_ids"])
 
-        e1 = Employee.objects.create(name="Scott", age=40, company=c1)
-        e2 = Employee.objects.create(name="Isaac", age=9, company=c1)
+    def test_skip_creates(self):
+        c1 = self.c1
 
         # create a new employee that will be ignored
         new_objs = [
             Employee(name="John", age=52, company=c1)
         ]
 
-        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=("name",), skip_creates=True, skip_deletes=True)
+        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=KEY_FIELDS, skip_creates=True, skip_deletes=True)
 
         self.assertEqual(2, Employee.objects.count())
-        self.assertEqual(["Scott", "Isaac"], [x.name for x in Employee.objects.all().order_by('id')])
+        self.assertEqual(["Scott", "Isaac"], list(Employee.objects.order_by('id').values_list('name', flat=True)))
 
         self.assertEqual(0, ret["stats"]["updated"])
         self.assertEqual(0, ret["stats"]["created"])
         self.assertEqual(0, ret["stats"]["deleted"])
 
-    def test_skip_updates(self):
-        c1 = Company.objects.create(name="My Company LLC")
+        self.assertEqual([], ret["created_instances"])
 
-        e1 = Employee.objects.create(name="Scott", age=40, company=c1)
-        e2 = Employee.objects.create(name="Isaac", age=9, company=c1)
+    def test_skip_updates(self):
+        c1 = self.c1
 
         # update employee that will be ignored, create a new one
         new_objs = [
@@ -176,35 +370,29 @@ class BulkSyncTests(TestCase):
             Employee(name="Alice", age=36, company=c1)
         ]
 
-        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=("name",), skip_updates=True)
-
-        # the age should not have been updated
-        new_e1 = Employee.objects.get(id=e1.id)
-        self.assertEqual(40, new_e1.age)
-
-        # Isaac is "stale" object - was deleted, Alice was created
-        self.assertEqual(2, Employee.objects.count())
-        self.assertEqual(["Scott", "Alice"], [x.name for x in Employee.objects.all().order_by('id')])
+        ret = bulk_sync(new_models=new_objs, filters=None, key_fields=KEY_FIELDS, skip_updates=True)
 
+        # Scott's age should not have been updated; Isaac is "stale" object - was deleted, Alice was created
+        self.assertEqual(
+            [("Scott", 40), ("Alice", 36)], list(Employee.objects.order_by('id').values_list('name', 'age'))
+        )
 
         self.assertEqual(0, ret["stats"]["updated"])
         self.assertEqual(1, ret["stats"]["created"])
         self.assertEqual(1, ret["stats"]["deleted"])
 
+        self.assertEqual({}, ret["updated_instances"])
+        self.assertEqual([new_objs[1]], ret["created_instances"])
+        self.assertEqual([self.e2.id], ret["deleted_ids"])
+
 
 
-class BulkCompareTests(TestCase):
+class BulkCompareTests(TwoCompaniesTestCase):
     """ Test `bulk_compare` method """
 
     @classmethod
     def setUpTestData(cls):
-        cls.c1 = Company.objects.create(name="Foo Products, Ltd.")
-        cls.c2 = Company.objects.create(name="Bar Microcontrollers, Inc.")
-
-        cls.e1 = Employee.objects.create(name="Scott", age=40, company=cls.c1)
-        cls.e2 = Employee.objects.create(name="Isaac", age=9, company=cls.c1)
-        cls.e3 = Employee.objects.create(name="Zoe", age=9, company=cls.c1)
-        cls.e4 = Employee.objects.create(name="Bob", age=25, company=cls.c2)
+        super().setUpTestData()
 
         # We should update Scott's and Isaac's age, delete Zoe, add Newguy and
         # add a second Bob (since he's not in company c1, which we filtered on.)
@@ -220,7 +408,7 @@ class BulkCompareTests(TestCase):
         e3 = self.e3
         new_objs = self.new_objs
 
-        ret = bulk_compare(old_models=Employee.objects.filter(company=c1), new_models=new_objs, key_fields=("name",))
+        ret = bulk_compare(old_models=Employee.objects.filter(company=c1), new_models=new_objs, key_fields=KEY_FIELDS)
 
         self.assertEqual([new_objs[2], new_objs[3]], ret["added"])
         self.assertEqual([e3], list(ret["removed"]))
@@ -236,7 +424,7 @@ class BulkCompareTests(TestCase):
         ret = bulk_compare(
             old_models=Employee.objects.filter(company=c1).order_by("name"),
             new_models=new_objs,
-            key_fields=("name",),
+            key_fields=KEY_FIELDS,
             ignore_fields=("age",),
         )
 
@@ -254,7 +442,7 @@ class BulkCompareTests(TestCase):
         ret = bulk_compare(
             old_models=Employee.objects.filter(company=c1).order_by("name"),
             new_models=new_objs,
-            key_fields=("name",),
+            key_fields=KEY_FIELDS,
             ignore_fields=("company_id",),
         )
 
@@ -263,3 +451,24 @@ class BulkCompareTests(TestCase):
         self.assertEqual([new_objs[0]], ret["updated"])
         self.assertEqual({new_objs[0]: {'age': (40, 41)}}, ret["updated_details"])
         self.assertEqual([new_objs[1]], ret["unchanged"])
+
+    def test_bulk_compare_does_not_load_deferred_ignored_field(self):
+        c1 = self.c1
+        new_objs = self.new_objs
+
+        with CaptureQueriesContext(connection) as ctx:
+            ret = bulk_compare(
+                old_models=Employee.objects.filter(company=c1).defer("age"),
+                new_models=new_objs,
+                key_fields=KEY_FIELDS,
+                ignore_fields=("age",),
+            )
+
+        # Only the queryset itself is evaluated; "age" is never lazy-loaded.
+        self.assertEqual(1, len(ctx.captured_queries))
+        self.assertEqual([], ret["updated"])
+        self.assertEqual([new_objs[0], new_objs[1]], ret["unchanged"])
+
+    def test_compare_objs_skips_reverse_relations(self):
+        # Company has a reverse relation from Employee, which isn't a column and must not be compared.
+        self.assertEqual({"name": ("Foo", "Bar")}, compare_objs(Company(name="Foo"), Company(name="Bar")))